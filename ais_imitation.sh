@@ -6,6 +6,8 @@ ALGO=bc
 ENV=ais-v0
 TRAIN_STEPS=30
 STRUCTURE="[512,256,128,64,32]"
+# rollout worker processes for the gail generator
+N_ENVS=1
 EXPERT_PATH=data/expert_trajectories/$EXPERIMENT_ID-ais_expert_trajectories.pickle
 
 ## SAMPLE EXPERT TRAJECTORIES (USUALLY ONCE)
@@ -25,7 +27,7 @@ do
 
        #python ./deeprl/ais_imitation.py --mode train --algo $ALGO --env $ENV \
       #        --training_steps $TRAIN_STEPS --network $STRUCTURE \
-      #    --policy_path $POLICY_SAVE --expert_samples_path $EXPERT_PATH --seed $SEED
+      #    --policy_path $POLICY_SAVE --expert_samples_path $EXPERT_PATH --seed $SEED --n_envs $N_ENVS
 
         ## TEST THE TRAINED POLICY
         python ./deeprl/ais_imitation.py --mode test --env  $ENV --algo $ALGO --policy_path  $POLICY_SAVE  \
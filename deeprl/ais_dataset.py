@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# columns the observation bounds of the environment are derived from
+BOUND_COLUMNS = ["lat", "lon", "speed", "direction", "length", "width", "tide_level", "wind_force", "wind_direction"]
+# columns of a single episode (in this order)
+EPISODE_COLUMNS = ["lat", "lon", "direction", "speed", "tide_level", "wind_force", "wind_direction"]
+DTYPES = {"speed": np.float32, "cog": np.float32, "lat": np.float32, "lon": np.float32, "direction": np.float32}
+
+
+def partition_keys(keys, index, count):
+    """Contiguous, disjoint share `index` of `count` of the (sorted) trajectory keys, e.g. per rollout worker"""
+    return keys[index * len(keys) // count : (index + 1) * len(keys) // count]
+
+
+class InMemoryTrajectories:
+    """
+    All trajectories of a single csv file, e.g. `aishub_linear_big_ships_2020_wind_tides_lengths.csv`.
+    With a `partition` (index, count) the file is read in chunks and only the rows of that share
+    of the trajectories are kept, while the bounds still cover the whole file.
+    """
+
+    def __init__(self, dataset, partition=None, chunksize=1000000):
+        if partition is None:
+            df = pd.read_csv(dataset, dtype=DTYPES)
+            self.bounds = {c: (df[c].min(), df[c].max()) for c in BOUND_COLUMNS}
+        else:
+            lows, highs, ids = [], [], set()
+            for chunk in pd.read_csv(dataset, dtype=DTYPES, usecols=["traj_id"] + BOUND_COLUMNS, chunksize=chunksize):
+                lows.append(chunk[BOUND_COLUMNS].min())
+                highs.append(chunk[BOUND_COLUMNS].max())
+                ids.update(chunk["traj_id"].unique().tolist())
+            self.bounds = {c: (min(l[c] for l in lows), max(h[c] for h in highs)) for c in BOUND_COLUMNS}
+            share = set(partition_keys(sorted(ids), *partition))
+            df = pd.concat(
+                chunk[chunk["traj_id"].isin(share)] for chunk in pd.read_csv(dataset, dtype=DTYPES, chunksize=chunksize)
+            )
+        self.trajectories = dict(list(df.groupby("traj_id")))
+        self.keys = list(self.trajectories.keys())
+
+    def episode_order(self):
+        order = list(self.keys)
+        random.shuffle(order)
+        return order
+
+    def restrict(self, keys):
+        self.trajectories = {key: self.trajectories[key] for key in keys}
+        self.keys = list(keys)
+
+    def select(self, time_multipler):
+        # only the finest resolution is available, stride through its rows
+        return time_multipler
+
+    def get(self, key):
+        return self.trajectories[key]
+
+
+class ShardedTrajectories:
+    """
+    Trajectories spread over multiple csv shards (e.g. the monthly `aishub_linear_10S_{year}_{month}`
+    outputs) described by a manifest, see `build_manifest`. Bounds are taken from the manifest,
+    shards are only read once an episode needs them and at most `cache_size` decoded shards
+    (plus the one being prefetched) are held in memory.
+    """
+
+    def __init__(self, manifest, cache_size=2, partition=None):
+        with open(manifest, "r") as f:
+            meta = json.load(f)
+        root = os.path.dirname(os.path.abspath(manifest))
+        self.paths = [os.path.join(root, shard["path"]) for shard in meta["shards"]]
+        self.bounds = {
+            c: (
+                min(shard["bounds"][c][0] for shard in meta["shards"]),
+                max(shard["bounds"][c][1] for shard in meta["shards"]),
+            )
+            for c in BOUND_COLUMNS
+        }
+        self.keys = [(i, traj_id) for i, shard in enumerate(meta["shards"]) for traj_id in shard["trajectories"]]
+        if partition is not None:
+            self.restrict(partition_keys(self.keys, *partition))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next_shard = {}
+
+    def episode_order(self):
+        """
+        Shuffle the order of the shards and of the trajectories within each shard, so that
+        every shard is decoded once per pass through the data. Only shards with trajectories in
+        `keys` are visited (and prefetched), e.g. after `restrict`.
+        """
+        shards = sorted({key[0] for key in self.keys})
+        random.shuffle(shards)
+        by_shard = {i: [] for i in shards}
+        for key in self.keys:
+            by_shard[key[0]].append(key)
+        order = []
+        for i in shards:
+            random.shuffle(by_shard[i])
+            order.extend(by_shard[i])
+        self._next_shard = dict(zip(shards, shards[1:] + shards[:1]))
+        return order
+
+    def restrict(self, keys):
+        self.keys = list(keys)
+
+    def select(self, time_multipler):
+        # only the finest resolution is available, stride through its rows
+        return time_multipler
+
+    def _load(self, shard):
+        df = pd.read_csv(self.paths[shard], dtype=DTYPES, usecols=["traj_id"] + EPISODE_COLUMNS)
+        return {traj_id: traj[EPISODE_COLUMNS] for traj_id, traj in df.groupby("traj_id")}
+
+    def _shard(self, shard):
+        with self._lock:
+            if shard in self._cache:
+                self._cache.move_to_end(shard)
+                return self._cache[shard]
+            future = self._pending.pop(shard, None)
+        trajectories = future.result() if future is not None else self._load(shard)
+        with self._lock:
+            self._cache[shard] = trajectories
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return trajectories
+
+    def prefetch(self, shard):
+        with self._lock:
+            if shard in self._cache or shard in self._pending:
+                return
+            # a stale prefetch (e.g. from before a reshuffle) is dropped to keep memory bounded
+            self._pending = {shard: self._executor.submit(self._load, shard)}
+
+    def get(self, key):
+        shard, traj_id = key
+        trajectories = self._shard(shard)
+        next_shard = self._next_shard.get(shard)
+        if next_shard is not None and next_shard != shard:
+            self.prefetch(next_shard)
+        return trajectories[traj_id]
+
+
+def load_trajectories(dataset, cache_size=2, partition=None):
+    """
+    A json manifest is loaded lazily shard by shard, a pyramid directory (see `trajectory_pyramid.py`)
+    level by level and a csv file completely (or only the rows of `partition`, see `partition_keys`)
+    """
+    if dataset.endswith(".json"):
+        return ShardedTrajectories(dataset, cache_size, partition)
+    if os.path.isdir(dataset):
+        from deeprl.trajectory_pyramid import PyramidTrajectories
+
+        return PyramidTrajectories(dataset, partition)
+    return InMemoryTrajectories(dataset, partition)
+
+
+def build_manifest(shards, manifest, chunksize=1000000):
+    """
+    Scan the csv shards once in chunks and write a manifest with their trajectory ids and
+    per-column bounds. Shard paths are stored relative to the manifest.
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    entries = []
+    for path in shards:
+        lows, highs, trajectories = [], [], {}
+        for chunk in pd.read_csv(path, dtype=DTYPES, usecols=["traj_id"] + BOUND_COLUMNS, chunksize=chunksize):
+            lows.append(chunk[BOUND_COLUMNS].min())
+            highs.append(chunk[BOUND_COLUMNS].max())
+            trajectories.update(dict.fromkeys(chunk["traj_id"].unique().tolist()))
+        entries.append(
+            {
+                "path": os.path.relpath(os.path.abspath(path), root),
+                "bounds": {
+                    c: [float(min(l[c] for l in lows)), float(max(h[c] for h in highs))] for c in BOUND_COLUMNS
+                },
+                "trajectories": list(trajectories),
+            }
+        )
+        print(f"{path}: {len(trajectories)} trajectories")
+    with open(manifest, "w") as f:
+        json.dump({"shards": entries}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a manifest of (monthly) AIS csv shards for the ais environment")
+    parser.add_argument("manifest", type=str, help="Path of the manifest to write, e.g. data/usable/2020_2021.json")
+    parser.add_argument("shards", nargs="+", type=str, help="csv shards, e.g. data/usable/*_2020_*.csv")
+    args = parser.parse_args()
+    build_manifest(args.shards, args.manifest)
@@ -12,6 +12,7 @@ from gym import core, spaces
 from statistics import mean, median, stdev
 from matplotlib.artist import Artist
 import datetime
+from deeprl.ais_dataset import load_trajectories
 
 KNOTS_TO_KMH = 1.852
 MS_TO_KNOTS = 1.94384
@@ -22,55 +23,60 @@ class AISenv(core.Env):
         self,
         dataset="data/usable/aishub_linear_big_ships_2020_wind_tides_lengths.csv",
         time_interval=10,
+        cache_size=2,
+        time_multipler=1,
+        partition=None,
     ):
-        # Trajectory ID column 'traj_id'
+        # Trajectory ID column 'traj_id'; either a single csv file, a json manifest of csv shards
+        # or a directory with a multi-resolution pyramid of the trajectories.
+        # partition (index, count): only load that share of the trajectories (e.g. per rollout worker)
         print("loading in ais data...")
-        self.df = pd.read_csv(dataset, dtype={'speed': np.float32, 'cog': np.float32, 'lat': np.float32, 'lon': np.float32, 'direction': np.float32})
-        self.num_trajectories = self.df.groupby("traj_id").count().shape[0]
-        self.trajectory_list = list(self.df.groupby("traj_id"))
-        random.shuffle(self.trajectory_list)
+        self.dataset = dataset
+        self.trajectories = load_trajectories(dataset, cache_size, partition)
+        self.num_trajectories = len(self.trajectories.keys)
+        self.trajectory_list = self.trajectories.episode_order()
         self.time_interval_secs = time_interval
         print(self.num_trajectories)
+        self.time_multipler = time_multipler
+        self._select_level()
+
+        # Custom variables
+        self.step_counter = 0
+        self.training = True
+        self.trajectory_index = -1
+        self.figure = None
+        # curve the agent has to follow
+        self.true_traj = None
+        # curve that the agent took
+        self.agent_traj = None
+        print(self.MIN_LON, self.MAX_LON, self.MIN_LAT, self.MAX_LAT)
+
+    def _select_level(self):
+        # resolution of the trajectories for the current time_multipler and the bounds at that resolution
+        self.level_multipler = self.time_multipler
+        self.row_stride = self.trajectories.select(self.time_multipler)
+        self._set_bounds(self.trajectories.bounds)
+
+    def _set_bounds(self, bounds):
         #################################################
         ##            DEFINE CONSTANTS                 ##
         #################################################
         
         # State boundaries
-        self.MIN_LON, self.MAX_LON = self.df["lon"].min(), self.df["lon"].max()
-        self.MIN_LAT, self.MAX_LAT = self.df["lat"].min(), self.df["lat"].max()
+        self.MIN_LON, self.MAX_LON = bounds["lon"]
+        self.MIN_LAT, self.MAX_LAT = bounds["lat"]
         self.MIN_COURSE, self.MAX_COURSE = -180, 180
         self.MIN_TEMPO, self.MAX_TEMPO = (
-            self.df["speed"].min() * MS_TO_KNOTS,
-            self.df["speed"].max() * MS_TO_KNOTS,
-        )
-        self.MIN_CURRENT_HEADING, self.MAX_CURRENT_HEADING = (
-            self.df["direction"].min(),
-            self.df["direction"].max(),
-        )
-        self.MIN_CURRENT_SPEED, self.MAX_CURRENT_SPEED = (
-            self.df["speed"].min(),
-            self.df["speed"].max(),
-        )
-        self.MIN_LENGTH, self.MAX_LENGTH = (
-            self.df["length"].min(),
-           self.df["length"].max(),
-       )
-        self.MIN_WIDTH, self.MAX_WIDTH = (
-            self.df["width"].min(),
-            self.df["width"].max(),
-       )
-        self.MIN_LEVEL, self.MAX_LEVEL = (
-            self.df["tide_level"].min(),
-            self.df["tide_level"].max(),
-        )
-        self.MIN_WINDFORCE, self.MAX_WINDFORCE = (
-            self.df["wind_force"].min(),
-            self.df["wind_force"].max(),
-        )
-        self.MIN_WINDDIRECTION, self.MAX_WINDDIRECTION = (
-            self.df["wind_direction"].min(),
-            self.df["wind_direction"].max(),
+            bounds["speed"][0] * MS_TO_KNOTS,
+            bounds["speed"][1] * MS_TO_KNOTS,
         )
+        self.MIN_CURRENT_HEADING, self.MAX_CURRENT_HEADING = bounds["direction"]
+        self.MIN_CURRENT_SPEED, self.MAX_CURRENT_SPEED = bounds["speed"]
+        self.MIN_LENGTH, self.MAX_LENGTH = bounds["length"]
+        self.MIN_WIDTH, self.MAX_WIDTH = bounds["width"]
+        self.MIN_LEVEL, self.MAX_LEVEL = bounds["tide_level"]
+        self.MIN_WINDFORCE, self.MAX_WINDFORCE = bounds["wind_force"]
+        self.MIN_WINDDIRECTION, self.MAX_WINDDIRECTION = bounds["wind_direction"]
         self.MIN_ANGLE_TO_DESTINATION, self.MAX_ANGLE_TO_DESTINATION = -180, 180
         _, max_dist = self._calculate_angle_distance(
             [self.MIN_LON, self.MIN_LAT], [self.MAX_LON, self.MAX_LAT]
@@ -148,8 +154,6 @@ class AISenv(core.Env):
         )
         self.action_space = spaces.Box(low=low, high=high)
         
-        # Custom variables
-        self.step_counter = 0
         self.scale = np.array(
             [
                 1 / self.DLAT,
@@ -193,19 +197,12 @@ class AISenv(core.Env):
             ]
         )
 
-        self.training = True
-        self.trajectory_index = -1
-        self.figure = None
-        # curve the agent has to follow
-        self.true_traj = None
-        # curve that the agent took
-        self.agent_traj = None
-        self.time_multipler = 1
-        print(self.MIN_LON, self.MAX_LON, self.MIN_LAT, self.MAX_LAT)
-
     def get_trajectory_count(self):
         return len(self.trajectory_list)
 
+    def get_trajectory(self, key):
+        return self.trajectories.get(key)
+
     def set_trajectory_index(self, index):
         self.trajectory_index = index
 
@@ -216,11 +213,14 @@ class AISenv(core.Env):
 
     def reset(self):
         self.step_counter = 0
+        if self.time_multipler != self.level_multipler:
+            self._select_level()
         self.trajectory_index = self.trajectory_index + 1
         if self.trajectory_index >= self.num_trajectories:
-            random.shuffle(self.trajectory_list)
+            self.trajectory_list = self.trajectories.episode_order()
             self.trajectory_index = 0
-        self.episode_df = self.trajectory_list[self.trajectory_index][1]
+        self.episode_key = self.trajectory_list[self.trajectory_index]
+        self.episode_df = self.get_trajectory(self.episode_key)
         # , "length", "width" "tide_level"
         self.episode_df = self.episode_df[["lat", "lon", "direction", "speed", "tide_level", "wind_force", "wind_direction"]]
         self.length_episode = self.episode_df.shape[0]
@@ -250,7 +250,7 @@ class AISenv(core.Env):
     def step_expert(self):
         last_obs = self.state
         self.step_counter = np.clip(
-            self.step_counter + self.time_multipler, 0, self.length_episode - 1
+            self.step_counter + self.row_stride, 0, self.length_episode - 1
         )
         self.state = self[self.step_counter]
         next_obs = self.state
@@ -291,7 +291,7 @@ class AISenv(core.Env):
         lat_pred = np.clip(lat_pred, self.MIN_LAT, self.MAX_LAT)
         # Compare with observation at next step
         self.step_counter = np.clip(
-            self.step_counter + self.time_multipler, 0, self.length_episode - 1
+            self.step_counter + self.row_stride, 0, self.length_episode - 1
         )
         self.state = self[self.step_counter]
         # print(f'{self.state} {cog_a} {sog_a}')
@@ -21,6 +21,9 @@ from stable_baselines3 import DDPG
 from stable_baselines3.common.noise import OrnsteinUhlenbeckActionNoise
 from stable_baselines3.common.vec_env import VecNormalize, DummyVecEnv
 import ast
+from deeprl import trajectory_metrics as tm
+from deeprl.shm_vec_env import ShmVecEnv
+from deeprl.evaluation_cache import EvaluationCache
 
 # needs to be imported to register the custom environments
 from gym.envs.registration import register
@@ -32,6 +35,8 @@ register(
 os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
 print(torch.cuda.is_available())
 TRAIN_SPLIT = 0.80
+# PPO rollout steps per GAIL update, summed over all rollout workers
+GAIL_ROLLOUT_STEPS = 1024
 
 
 def set_seed(seed):
@@ -51,10 +56,17 @@ class CustomFeedForwardPolicy(sb3.common.policies.ActorCriticPolicy):
 OUTPUT = ""
 
 
-def policy_in_action(env, policy, evalution_path, render):
+def policy_in_action(
+    env, policy, evalution_path, render, similarity=False, knn=0, cache=None, fingerprint=None
+):
     df = pd.DataFrame(columns=["id", "ep_length", "cum_reward", "performance"])
     n_trajs = env.get_trajectory_count()
     start_index = int(TRAIN_SPLIT * n_trajs)
+    # expert trajectories are the ones of the training split
+    expert_keys = env.trajectory_list[:start_index]
+    expert_index = None
+    # nearest experts depend on the expert set (TRAIN_SPLIT and the seed's shuffle), the rollouts don't
+    experts_fingerprint = cache.key(*expert_keys) if cache is not None and knn > 0 else None
     env.set_trajectory_index(start_index)  # +1 with the first reset()
     obs = env.reset()
     cum_reward = 0
@@ -62,21 +74,63 @@ def policy_in_action(env, policy, evalution_path, render):
     saved_tracks = []
     for i in tqdm(range(0, n_trajs - start_index - 1)):
         # for i in tqdm(range(0, 2)):
-        done = False
-        distances = []
-        while not done:
-            action, _ = policy.predict(obs, deterministic=True)
-            obs, reward, done, info = env.step(action)
-            distances.append(info["distance_in_meters"])
-            cum_reward += reward
-            t += 1 
-            #env.render(mode="human", svg=None)      
-        if mean(distances) < 450 and t > 120:
+        # rollouts are cached independently of the requested metrics, so rerunning with
+        # --similarity or --knn only computes the metrics from the cached trajectories
+        cached = None
+        if cache is not None:
+            rollout_key = cache.key(fingerprint, env.episode_key)
+            cached = cache.get(rollout_key)
+        if cached is not None:
+            episode, agent_traj, true_traj = cached
+            updated = False
+        else:
+            done = False
+            distances = []
+            while not done:
+                action, _ = policy.predict(obs, deterministic=True)
+                obs, reward, done, info = env.step(action)
+                distances.append(info["distance_in_meters"])
+                cum_reward += reward
+                t += 1 
+                #env.render(mode="human", svg=None)      
+            agent_traj, true_traj = env.agent_traj, env.true_traj
+            episode = {
+                "ep_length": t,
+                "cum_reward": cum_reward,
+                "performance": cum_reward / t,
+                "distances": distances,
+            }
+            updated = True
+        if similarity or knn > 0:
+            agent_xy = tm.project(agent_traj)
+        if similarity and "dtw" not in episode:
+            true_xy = tm.project(true_traj)
+            episode["dtw"] = tm.dtw(agent_xy, true_xy, projected=True)
+            episode["frechet"] = tm.discrete_frechet(agent_xy, true_xy, projected=True)
+            updated = True
+        if cache is not None and updated:
+            cache.put(rollout_key, (episode, agent_traj, true_traj))
+        if knn > 0:
+            nearest_experts = None
+            if cache is not None:
+                knn_key = cache.key(fingerprint, env.episode_key, knn, experts_fingerprint)
+                nearest_experts = cache.get(knn_key)
+            if nearest_experts is None:
+                if expert_index is None:
+                    expert_index = tm.TrajectoryIndex(
+                        [env.get_trajectory(k)[["lat", "lon"]].values for k in expert_keys],
+                        ids=expert_keys,
+                    )
+                nearest_experts = expert_index.k_nearest(agent_xy, knn, projected=True)
+                if cache is not None:
+                    cache.put(knn_key, nearest_experts)
+            episode = {**episode, "nearest_experts": nearest_experts}
+        if mean(episode["distances"]) < 450 and episode["ep_length"] > 120:
             #env.render(mode="human", svg=None)
             #time.sleep(3)
-            #np.save(f'deeprl/scripts/improved_{i}_agent.npy', env.agent_traj)
-            #np.save(f'deeprl/scripts/improved_{i}_true.npy', env.true_traj)
-            saved_tracks.append((env.agent_traj, env.true_traj))
+            #np.save(f'deeprl/scripts/improved_{i}_agent.npy', agent_traj)
+            #np.save(f'deeprl/scripts/improved_{i}_true.npy', true_traj)
+            saved_tracks.append((agent_traj, true_traj))
            # s = (env.agent_traj, env.true_traj)
            # for i in range(0, len(s[0])):
            #     env.render("human", None, s[0][:i], s[1][:i])
@@ -87,16 +141,7 @@ def policy_in_action(env, policy, evalution_path, render):
             # save as svg = f'DOUBLE_{OUTPUT}_mean_distance={int(mean(distances))}'
      #       env.render(mode="human", svg=None)
         obs = env.reset()
-        df = df.append(
-            {
-                "id": i + 1,
-                "ep_length": t,
-                "cum_reward": cum_reward,
-                "performance": cum_reward / t,
-                "distances": distances,
-            },
-            ignore_index=True,
-        )
+        df = df.append({"id": i + 1, **episode}, ignore_index=True)
         # print(f"'id': {i+1}, 'ep_length': {t}, 'cum_reward': {cum_reward}, 'performance': {cum_reward/t}'distances': {mean(distances)}")
         # print(f'cum:{cum_reward} t:{t}')
 
@@ -182,7 +227,8 @@ def train_GAIL(venv, expert_transitions, steps, net_arch, policy_save_path):
         venv=venv,
         demonstrations=expert_transitions,
         demo_batch_size=64,
-        gen_algo=sb3.PPO("MlpPolicy", venv, verbose=1, n_steps=1024),
+        # GAIL_ROLLOUT_STEPS per update in total, spread over all rollout workers
+        gen_algo=sb3.PPO("MlpPolicy", venv, verbose=1, n_steps=GAIL_ROLLOUT_STEPS // venv.num_envs),
         reward_net=gail_reward_net,
         # gen_algo=sb3.DDPG("MlpPolicy", venv, verbose=1),
         allow_variable_horizon=True,
@@ -218,6 +264,12 @@ if __name__ == "__main__":
     )
     parser.add_argument("--training_steps", default=50000, type=int, help=""),
     parser.add_argument("--seed", default=3, type=int, help=""),
+    parser.add_argument(
+        "--n_envs",
+        default=1,
+        type=int,
+        help=f"Number of GAIL rollout worker processes (shared memory vec env) if > 1, has to divide {GAIL_ROLLOUT_STEPS}",
+    ),
     parser.add_argument("--animation_delay", default=0.1, type=float, help=""),
     parser.add_argument(
         "--policy_path",
@@ -238,6 +290,36 @@ if __name__ == "__main__":
         help="Path to store the evaluation dataframe",
     )
     parser.add_argument("--render", dest="render", action="store_true")
+    parser.add_argument(
+        "--eval_cache_dir",
+        default="experiments/.eval_cache",
+        type=str,
+        help="Directory of the per-episode evaluation cache ('' to disable)",
+    )
+    parser.add_argument(
+        "--eval_cache_size_mb",
+        default=1024,
+        type=int,
+        help="Least recently used cache entries are evicted beyond this size",
+    )
+    parser.add_argument(
+        "--refresh_eval_cache",
+        dest="refresh_eval_cache",
+        action="store_true",
+        help="Re-evaluate all episodes and overwrite their cache entries",
+    )
+    parser.add_argument(
+        "--similarity",
+        dest="similarity",
+        action="store_true",
+        help="Report DTW and discrete Fréchet distance between agent and true trajectory per episode",
+    )
+    parser.add_argument(
+        "--knn",
+        default=0,
+        type=int,
+        help="Report the k nearest expert trajectories (DTW) of every agent trajectory",
+    )
     args = parser.parse_args()
 
     set_seed(args.seed)
@@ -246,6 +328,10 @@ if __name__ == "__main__":
     ) and args.expert_samples_path == "":
         print("Provide a path to a saved the expert samples --expert_samples_path")
         sys.exit(2)
+    if args.n_envs < 1 or GAIL_ROLLOUT_STEPS % args.n_envs != 0:
+        # otherwise PPO's rollout would shrink (or be empty) and its minibatches get truncated
+        print(f"--n_envs has to divide the {GAIL_ROLLOUT_STEPS} rollout steps per update, e.g. 2, 4, 8, 16")
+        sys.exit(2)
 
     if args.mode == "sample":
         print("kkadkadk")
@@ -258,28 +344,37 @@ if __name__ == "__main__":
             # every instance contains observations and actions for a single expert
             # demonstration.
             transitions = pickle.load(f)
-        venv = ut.make_vec_env(args.env, n_envs=1)
+        if args.algo == "gail" and args.n_envs > 1:
+            # every worker samples from its own partition of the trajectories, seeded by seed + rank
+            venv = ShmVecEnv(args.env, n_envs=args.n_envs, seed=args.seed)
+        else:
+            # BC only needs the observation and action spaces
+            venv = ut.make_vec_env(args.env, n_envs=1)
         # transform string representation of network architecture to python array instance
         network_structure = ast.literal_eval(args.network)
-        if args.algo == "bc":
-            train_BC(
-                venv,
-                transitions,
-                args.training_steps,
-                network_structure,
-                args.policy_path,
-            )
-        elif args.algo == "gail":
-            train_GAIL(
-                venv,
-                transitions,
-                args.training_steps,
-                network_structure,
-                args.policy_path,
-            )
-        else:
-            print("Unknown algorithm provided by --algo")
-            sys.exit(2)
+        try:
+            if args.algo == "bc":
+                train_BC(
+                    venv,
+                    transitions,
+                    args.training_steps,
+                    network_structure,
+                    args.policy_path,
+                )
+            elif args.algo == "gail":
+                train_GAIL(
+                    venv,
+                    transitions,
+                    args.training_steps,
+                    network_structure,
+                    args.policy_path,
+                )
+            else:
+                print("Unknown algorithm provided by --algo")
+                sys.exit(2)
+        finally:
+            # stops the rollout workers and releases the shared memory
+            venv.close()
         pass
     elif args.mode == "test":
         if args.policy_path == "":
@@ -287,13 +382,36 @@ if __name__ == "__main__":
             sys.exit(2)
         env = gym.make(args.env)
         if args.algo == "bc":
-            policy_in_action(
-                env,
-                bc.reconstruct_policy(args.policy_path),
-                args.evaluation_path,
-                args.render,
-            )
+            policy_file = args.policy_path
+            policy = bc.reconstruct_policy(args.policy_path)
         elif args.algo == "gail":
-            policy = sb3.PPO.load(f"{args.policy_path}.zip")
+            policy_file = f"{args.policy_path}.zip"
+            policy = sb3.PPO.load(policy_file)
             # torch.load(f'{args.policy_path}.zip', device='auto')
-            policy_in_action(env, policy, args.evaluation_path, args.render)
+        else:
+            print("Unknown algorithm provided by --algo")
+            sys.exit(2)
+        cache, fingerprint = None, None
+        if args.eval_cache_dir != "":
+            cache = EvaluationCache(
+                args.eval_cache_dir, args.eval_cache_size_mb, args.refresh_eval_cache
+            )
+            # an episode's rollout depends on the policy, the data and the stepping; TRAIN_SPLIT and
+            # the seed only select the test episodes, except for --knn where they also determine
+            # the expert set and are part of the nearest experts' key (see policy_in_action)
+            fingerprint = cache.key(
+                cache.file_fingerprint(policy_file),
+                cache.dataset_fingerprint(env.dataset),
+                env.time_interval_secs,
+                env.time_multipler,
+            )
+        policy_in_action(
+            env,
+            policy,
+            args.evaluation_path,
+            args.render,
+            args.similarity,
+            args.knn,
+            cache,
+            fingerprint,
+        )
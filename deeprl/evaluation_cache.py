@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import pickle
+
+FINGERPRINTS = "fingerprints.json"
+
+
+class EvaluationCache:
+    """
+    Per-episode evaluation results stored as one pickle per entry in `directory`.
+    Entries are keyed by a hash of everything that determines an episode's outcome (see `key`),
+    hits refresh the modification time and the least recently used entries are evicted once the
+    cache grows beyond `max_size_mb`. With `refresh` every lookup misses and entries are rewritten.
+    """
+
+    def __init__(self, directory, max_size_mb=1024, refresh=False):
+        self.directory = directory
+        self.max_size = max_size_mb * 1024 * 1024
+        self.refresh = refresh
+        os.makedirs(directory, exist_ok=True)
+        self.fingerprints_path = os.path.join(directory, FINGERPRINTS)
+        if os.path.exists(self.fingerprints_path):
+            with open(self.fingerprints_path, "r") as f:
+                self.fingerprints = json.load(f)
+        else:
+            self.fingerprints = {}
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pkl")]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        if self.refresh or not os.path.exists(path):
+            return None
+        os.utime(path)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, key, value):
+        path = self._path(key)
+        if os.path.exists(path):
+            self.size -= os.path.getsize(path)
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(value, f)
+        os.replace(f"{path}.tmp", path)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        for entry in sorted(self._entries(), key=lambda e: e.stat().st_mtime):
+            if self.size <= self.max_size:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def file_fingerprint(self, path):
+        """sha256 of a file's content; only recomputed if its size or modification time changed"""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self.fingerprints.get(path)
+        if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        self.fingerprints[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+        with open(self.fingerprints_path, "w") as f:
+            json.dump(self.fingerprints, f)
+        return sha256.hexdigest()
+
+    def dataset_fingerprint(self, dataset):
+        """Fingerprint of a csv file, a manifest together with its shards or a pyramid directory"""
+        if os.path.isdir(dataset):
+            files = sorted(os.path.join(dataset, name) for name in os.listdir(dataset))
+        elif dataset.endswith(".json"):
+            with open(dataset, "r") as f:
+                root = os.path.dirname(os.path.abspath(dataset))
+                files = [dataset] + [os.path.join(root, shard["path"]) for shard in json.load(f)["shards"]]
+        else:
+            files = [dataset]
+        return self.key(*[self.file_fingerprint(path) for path in files])
@@ -0,0 +1,139 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from shapely import vectorized
+from shapely.geometry import Polygon, box
+from shapely.prepared import prep
+
+from deeprl.trajectory_metrics import project
+
+# hand-made polygon of the area of interest which excludes the inner harbour and floodgates
+# (basically just the Weser)
+WESER_AREA_OF_INTEREST = Polygon([(8.4867561,53.486203), (8.4867923,53.4861983), (8.5063362,53.4849813), (8.5257339,53.4990238), (8.5642719,53.5098972), \
+(8.5717392,53.51939), (8.574357,53.5290337), (8.5766745,53.5363798), (8.576932,53.5390577), (8.5747862,53.5414678), \
+(8.5707736,53.5437884), (8.5686493,53.5459176), (8.561182,53.5540766), (8.5582638,53.5545865), (8.5471916,53.566669), \
+(8.5452175,53.5694215), (8.5317421,53.5859837), (8.5214424,53.6045765), (8.5198975,53.6112475), (8.501358,53.6405673), \
+(8.4965515,53.6747479), (8.6160278,53.8760117), (8.0900574,53.9019109), (8.1202698,53.6373105), (8.3262634,53.6092107), \
+(8.3468628,53.5937274), (8.4555244,53.5527509), (8.5322571,53.5392873), (8.5497665,53.5361247), (8.5537148,53.5312274), \
+(8.5533714,53.5264316), (8.5487366,53.5233702), (8.5336304,53.5176549), (8.5180092,53.5108159), (8.5027313,53.5016276), \
+(8.4867561,53.486203)])
+
+OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+
+
+class AreaOfInterest:
+    """
+    Point-in-polygon test for large arrays of AIS positions. A coarse grid over the polygon's
+    bounding box is classified once (completely inside, outside or on the boundary), so most
+    points are decided by a grid lookup and only points in boundary cells are tested exactly
+    against the prepared polygon.
+    """
+
+    def __init__(self, polygon=WESER_AREA_OF_INTEREST, grid_size=64):
+        self.polygon = polygon
+        self.prepared = prep(polygon)
+        self.min_lon, self.min_lat, max_lon, max_lat = polygon.bounds
+        self.grid_size = grid_size
+        self.d_lon = (max_lon - self.min_lon) / grid_size
+        self.d_lat = (max_lat - self.min_lat) / grid_size
+        self.grid = np.full((grid_size, grid_size), OUTSIDE, dtype=np.uint8)
+        for i in range(grid_size):
+            for j in range(grid_size):
+                cell = box(
+                    self.min_lon + j * self.d_lon,
+                    self.min_lat + i * self.d_lat,
+                    self.min_lon + (j + 1) * self.d_lon,
+                    self.min_lat + (i + 1) * self.d_lat,
+                )
+                if self.prepared.contains(cell):
+                    self.grid[i, j] = INSIDE
+                elif self.prepared.intersects(cell):
+                    self.grid[i, j] = BOUNDARY
+
+    def contains(self, lon, lat):
+        lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+        i = np.floor((lat - self.min_lat) / self.d_lat)
+        j = np.floor((lon - self.min_lon) / self.d_lon)
+        in_bounds = (i >= 0) & (i < self.grid_size) & (j >= 0) & (j < self.grid_size)
+        cells = np.full(lon.shape, OUTSIDE, dtype=np.uint8)
+        cells[in_bounds] = self.grid[i[in_bounds].astype(int), j[in_bounds].astype(int)]
+        inside = cells == INSIDE
+        boundary = cells == BOUNDARY
+        inside[boundary] = vectorized.contains(self.prepared, lon[boundary], lat[boundary])
+        return inside
+
+
+def _drop_short(df, min_points, min_length=0):
+    sizes = df.groupby("traj_id")["traj_id"].transform("size")
+    keep = sizes >= min_points
+    if min_length > 0 and len(df) > 0:
+        # path length in meters of every part, each step is attributed to its second row
+        traj = df["traj_id"].to_numpy()
+        steps = np.zeros(len(df))
+        steps[1:] = np.hypot(*np.diff(project(df[["lat", "lon"]].to_numpy()), axis=0).T)
+        steps[1:][traj[1:] != traj[:-1]] = 0
+        keep &= pd.Series(steps, index=df.index).groupby(traj).transform("sum") >= min_length
+    return df[keep]
+
+
+def clip_chunks(chunks, area=None, min_points=2, min_length=0):
+    """
+    Clip a stream of dataframes with columns `traj_id`, `lat`, `lon` to the area of interest.
+    Rows of a trajectory have to be contiguous and ordered by time (as written by
+    `resample_and_interpolate`). Trajectories are split where they leave and re-enter the area;
+    the parts get the id `{traj_id}_{n}`, parts with less than `min_points` rows or shorter than
+    `min_length` meters are dropped.
+    """
+    area = AreaOfInterest() if area is None else area
+    last_traj, last_inside, last_segment = None, False, 0
+    pending = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        traj = chunk["traj_id"].to_numpy(dtype=object)
+        inside = area.contains(chunk["lon"].to_numpy(), chunk["lat"].to_numpy())
+        prev_traj = np.empty_like(traj)
+        prev_traj[0], prev_traj[1:] = last_traj, traj[:-1]
+        prev_inside = np.concatenate(([last_inside], inside[:-1]))
+        entered = inside & ((traj != prev_traj) | ~prev_inside)
+        # number of the part within its trajectory; a trajectory may continue from the last chunk
+        segment = pd.Series(entered).groupby(traj).cumsum().to_numpy(copy=True)
+        segment[traj == last_traj] += last_segment
+        last_traj, last_inside, last_segment = traj[-1], inside[-1], segment[-1]
+
+        out = chunk[inside].copy()
+        out["traj_id"] = out["traj_id"].astype(str) + "_" + segment[inside].astype(str)
+        if pending is not None:
+            out = pd.concat([pending, out])
+        # the last part may continue in the next chunk, hold it back to apply min_points
+        pending = None
+        if inside[-1]:
+            open_part = out["traj_id"].to_numpy() == out["traj_id"].iloc[-1]
+            pending, out = out[open_part], out[~open_part]
+        yield _drop_short(out, min_points, min_length)
+    if pending is not None:
+        yield _drop_short(pending, min_points, min_length)
+
+
+def clip_dataframe(df, area=None, min_points=2, min_length=0):
+    return pd.concat(list(clip_chunks([df], area, min_points, min_length)) or [df.iloc[:0]], ignore_index=True)
+
+
+def clip_csv(source, destination, area=None, min_points=2, min_length=0, chunksize=1000000):
+    """Clip a (monthly) csv file in a single streaming pass"""
+    header = True
+    for out in clip_chunks(pd.read_csv(source, chunksize=chunksize), area, min_points, min_length):
+        out.to_csv(destination, mode="w" if header else "a", header=header, index=False)
+        header = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clip resampled AIS trajectories to the Weser area of interest")
+    parser.add_argument("source", type=str, help="e.g. data/processed/aishub_linear_10S_2020_01.csv")
+    parser.add_argument("destination", type=str, help="e.g. data/processed/aishub_linear_10S_2020_01_aoi.csv")
+    parser.add_argument("--min_points", default=2, type=int, help="minimum number of rows per trajectory part")
+    parser.add_argument("--min_length", default=0, type=float, help="minimum length (meters) per trajectory part")
+    parser.add_argument("--chunksize", default=1000000, type=int, help="rows per chunk")
+    args = parser.parse_args()
+    clip_csv(args.source, args.destination, min_points=args.min_points, min_length=args.min_length, chunksize=args.chunksize)
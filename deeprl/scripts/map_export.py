@@ -0,0 +1,155 @@
+import json
+import os
+
+import folium
+import numpy as np
+
+from deeprl.trajectory_metrics import project
+
+# zoom levels of the precomputed level-of-detail files (the Weser fits into zoom 9 - 10)
+ZOOM_LEVELS = (8, 10, 12, 14)
+COLORS = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#42d4f4", "#f032e6", "#9a6324"]
+# ~1 m, far below the tolerance of any zoom level used here
+COORDINATE_DECIMALS = 5
+
+
+def zoom_tolerance(zoom, lat=53.54, pixels=1.0):
+    """Meters covered by `pixels` screen pixels at a web mercator zoom level"""
+    return 156543.03392 * np.cos(np.deg2rad(lat)) / 2**zoom * pixels
+
+
+def _segment_distances(points, a, b):
+    ab = b - a
+    length = ab @ ab
+    if length == 0:
+        return np.hypot(*(points - a).T)
+    t = np.clip(((points - a) @ ab) / length, 0, 1)
+    return np.hypot(*(points - (a + t[:, None] * ab)).T)
+
+
+def douglas_peucker(points, tolerance):
+    """Indices of the projected points (n, 2) kept by Douglas-Peucker with a tolerance in meters"""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(points[start + 1 : end], points[start], points[end])
+        i = np.argmax(distances)
+        if distances[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            stack.extend([(start, i), (i, end)])
+    return np.flatnonzero(keep)
+
+
+def visvalingam(points, tolerance):
+    """
+    Indices of the projected points (n, 2) kept by Visvalingam-Whyatt with a minimum effective
+    area in square meters. Every round removes all points whose triangle is below the tolerance
+    and a local minimum (so that no two neighbours are removed at once) in one vectorized step.
+    """
+    indices = np.arange(len(points))
+    while len(indices) > 2:
+        a, b, c = points[indices[:-2]], points[indices[1:-1]], points[indices[2:]]
+        area = 0.5 * np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1]))
+        padded = np.concatenate(([np.inf], area, [np.inf]))
+        remove = (area < tolerance) & (area <= padded[:-2]) & (area < padded[2:])
+        if not remove.any():
+            break
+        indices = np.concatenate(([indices[0]], indices[1:-1][~remove], [indices[-1]]))
+    return indices
+
+
+def simplify(points, tolerance, method="douglas_peucker"):
+    """Indices of the kept points; `tolerance` is a distance in meters for both methods"""
+    if len(points) < 3:
+        return np.arange(len(points))
+    if method == "douglas_peucker":
+        return douglas_peucker(points, tolerance)
+    if method == "visvalingam":
+        return visvalingam(points, tolerance**2)
+    raise ValueError(f"Unknown simplification method '{method}'")
+
+
+class TrajectoryLines:
+    """
+    All trajectories of a dataframe (columns `traj_id`, `lat`, `lon`) as one contiguous array with
+    offsets, projected once, instead of one `get_group` per trajectory.
+    """
+
+    def __init__(self, df, category=None):
+        # rows of a trajectory are contiguous and keep their (temporal) order
+        df = df.sort_values("traj_id", kind="stable")
+        self.ids, starts = np.unique(df["traj_id"].to_numpy(), return_index=True)
+        self.offsets = np.append(starts, len(df))
+        self.latlon = df[["lat", "lon"]].to_numpy(np.float64)
+        self.points = project(self.latlon)
+        self.categories = (
+            np.full(len(self.ids), "trajectories", dtype=object)
+            if category is None
+            else df[category].to_numpy()[starts]
+        )
+
+    def simplified(self, tolerance, method="douglas_peucker"):
+        """(traj_id, category, (lat, lon) array) of every simplified trajectory"""
+        for i, traj_id in enumerate(self.ids):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            kept = simplify(self.points[start:end], tolerance, method)
+            yield traj_id, self.categories[i], self.latlon[start:end][kept]
+
+    def to_geojson(self, tolerance, method="douglas_peucker"):
+        """One feature collection per category with the simplified trajectories"""
+        collections = {}
+        for traj_id, category, latlon in self.simplified(tolerance, method):
+            if len(latlon) < 2:
+                continue
+            coordinates = np.round(latlon[:, ::-1], COORDINATE_DECIMALS).tolist()
+            collections.setdefault(category, {"type": "FeatureCollection", "features": []})["features"].append(
+                {
+                    "type": "Feature",
+                    "properties": {"traj_id": str(traj_id)},
+                    "geometry": {"type": "LineString", "coordinates": coordinates},
+                }
+            )
+        return collections
+
+
+def export_lod(df, directory, name, category=None, zooms=ZOOM_LEVELS, method="douglas_peucker", pixels=1.0):
+    """
+    Write one GeoJSON file per category and zoom level ({name}_{category}_z{zoom}.geojson) and an
+    index ({name}.json) that lists them, so a map only loads the detail it can display.
+    """
+    os.makedirs(directory, exist_ok=True)
+    lines = TrajectoryLines(df, category)
+    index = {}
+    for zoom in zooms:
+        for category_name, collection in lines.to_geojson(zoom_tolerance(zoom, pixels=pixels), method).items():
+            file_name = f"{name}_{category_name}_z{zoom}.geojson".replace(" ", "_").replace("/", "_")
+            with open(os.path.join(directory, file_name), "w") as f:
+                json.dump(collection, f, separators=(",", ":"))
+            index.setdefault(str(category_name), {})[str(zoom)] = file_name
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def trajectory_map(df, category=None, zoom=11, method="douglas_peucker", location=(53.54, 8.56), weight=1.5):
+    """
+    Folium map with one GeoJSON layer per category, simplified for the initial zoom level
+    (replaces one `PolyLine` per trajectory)
+    """
+    m = folium.Map(location=list(location), zoom_start=zoom)
+    collections = TrajectoryLines(df, category).to_geojson(zoom_tolerance(zoom), method)
+    for i, (category_name, collection) in enumerate(collections.items()):
+        color = COLORS[i % len(COLORS)]
+        folium.GeoJson(
+            collection,
+            name=str(category_name),
+            style_function=lambda _, color=color: {"color": color, "weight": weight, "opacity": 1},
+        ).add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
@@ -6,6 +6,7 @@ import os
 import geopandas
 from datetime import timedelta
 from tqdm import tqdm
+from deeprl.scripts.area_of_interest import AreaOfInterest, clip_dataframe
 
 def resample_and_interpolate(trips, resample_interval="5S", interpolate_method="linear"):
     out = pd.DataFrame()
@@ -29,6 +30,8 @@ def resample_and_interpolate(trips, resample_interval="5S", interpolate_method="
     return out
 
 months = ["01", "04", "07", "10"]
+# excludes the inner harbour and floodgates; trajectories are split where they leave the area
+area_of_interest = AreaOfInterest()
 #for year in ["2020", "2021"]:
 for year in ["2021"]:
     for month in tqdm(months):
@@ -82,6 +85,8 @@ for year in ["2021"]:
         trips = mpd.OutlierCleaner(trips).clean({'speed': 3})
         print("start resampling...")
         linear_out = resample_and_interpolate(trips, resample_interval='10S', interpolate_method='linear')
+        # parts that only touch the area are dropped by the same minimum length as whole trajectories
+        linear_out = clip_dataframe(linear_out, area_of_interest, min_length=minimum_length)
         linear_out.to_csv(f'data/processed/aishub_linear_10S_{year}_{month}.csv', index=False)
 
 
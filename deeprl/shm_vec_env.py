@@ -0,0 +1,192 @@
+import multiprocessing as mp
+import random
+from multiprocessing import shared_memory
+
+import gym
+import numpy as np
+from imitation.data import wrappers
+from stable_baselines3.common import monitor
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import VecEnv
+
+
+def _worker(remote, parent_remote, env_id, rank, n_envs, seed, partition):
+    parent_remote.close()
+    random.seed(seed + rank)
+    np.random.seed(seed + rank)
+    # the partition is applied while loading, so no worker materializes the whole dataset
+    env = gym.make(env_id, partition=(rank, n_envs)) if partition else gym.make(env_id)
+    env.seed(seed + rank)
+    env = monitor.Monitor(env, None)
+    env = wrappers.RolloutInfoWrapper(env)
+    remote.send((env.observation_space, env.action_space))
+
+    blocks, obs, actions, rewards, dones = [], None, None, None, None
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "attach":
+                blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in data]
+                obs, actions, rewards, dones = [
+                    np.ndarray(shape, dtype=dtype, buffer=block.buf)
+                    for block, (_, shape, dtype) in zip(blocks, data)
+                ]
+                remote.send(None)
+            elif cmd == "step":
+                ob, reward, done, info = env.step(actions[rank])
+                if done:
+                    # save final observation where user can get it, then reset
+                    info["terminal_observation"] = ob
+                    ob = env.reset()
+                obs[rank] = ob
+                rewards[rank] = reward
+                dones[rank] = done
+                remote.send(info)
+            elif cmd == "reset":
+                obs[rank] = env.reset()
+                remote.send(None)
+            elif cmd == "seed":
+                remote.send(env.seed(data))
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            elif cmd == "close":
+                break
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+    except KeyboardInterrupt:
+        print("ShmVecEnv worker: got KeyboardInterrupt")
+    finally:
+        # views have to be released before the shared memory can be closed
+        del obs, actions, rewards, dones
+        for block in blocks:
+            block.close()
+        env.close()
+        remote.close()
+
+
+class ShmVecEnv(VecEnv):
+    """
+    Vectorized environment that runs every environment in its own process. Observations,
+    actions, rewards and dones are exchanged through preallocated shared memory arrays,
+    only commands and infos go through pipes.
+
+    With `partition` every worker constructs its environment with `partition=(rank, n_envs)`
+    (supported by the `AISenv`), i.e. only loads a disjoint share of the trajectories. Workers
+    are seeded with `seed + rank`, so rollouts are reproducible for a given seed and number of workers.
+
+    The workers are spawned, hence environments have to be registered when the main module
+    is imported (as in `ais_imitation.py`).
+    """
+
+    def __init__(self, env_id, n_envs, seed=0, start_method="spawn", partition=True):
+        self.waiting = False
+        self.closed = False
+        ctx = mp.get_context(start_method)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for rank, (work_remote, remote) in enumerate(zip(work_remotes, self.remotes)):
+            args = (work_remote, remote, env_id, rank, n_envs, seed, partition)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        spaces = [remote.recv() for remote in self.remotes]
+        observation_space, action_space = spaces[0]
+        super().__init__(n_envs, observation_space, action_space)
+
+        layout = [
+            (observation_space.shape, observation_space.dtype),
+            (action_space.shape, action_space.dtype),
+            ((), np.float32),
+            ((), np.bool_),
+        ]
+        self.blocks, buffers, attach = [], [], []
+        for shape, dtype in layout:
+            shape = (n_envs,) + tuple(shape)
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.blocks.append(block)
+            buffers.append(np.ndarray(shape, dtype=dtype, buffer=block.buf))
+            attach.append((block.name, shape, np.dtype(dtype).str))
+        self.buf_obs, self.buf_actions, self.buf_rews, self.buf_dones = buffers
+        for remote in self.remotes:
+            remote.send(("attach", attach))
+        for remote in self.remotes:
+            remote.recv()
+
+    def step_async(self, actions):
+        self.buf_actions[:] = np.reshape(actions, self.buf_actions.shape)
+        for remote in self.remotes:
+            remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        return np.copy(self.buf_obs), np.copy(self.buf_rews), np.copy(self.buf_dones), infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return np.copy(self.buf_obs)
+
+    def seed(self, seed=None):
+        for rank, remote in enumerate(self.remotes):
+            remote.send(("seed", None if seed is None else seed + rank))
+        return [remote.recv() for remote in self.remotes]
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.buf_obs = self.buf_actions = self.buf_rews = self.buf_dones = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("get_attr", attr_name))
+        return [remote.recv() for remote in target_remotes]
+
+    def set_attr(self, attr_name, value, indices=None):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("set_attr", (attr_name, value)))
+        for remote in target_remotes:
+            remote.recv()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("env_method", (method_name, method_args, method_kwargs)))
+        return [remote.recv() for remote in target_remotes]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("is_wrapped", wrapper_class))
+        return [remote.recv() for remote in target_remotes]
+
+    def _get_target_remotes(self, indices):
+        indices = self._get_indices(indices)
+        return [self.remotes[i] for i in indices]
@@ -0,0 +1,205 @@
+import numpy as np
+import pyproj
+from concurrent.futures import ProcessPoolExecutor
+
+# UTM zone 32N covers the Weser estuary, distances are in meters
+PROJECTION = "EPSG:32632"
+METRICS = ("dtw", "frechet")
+
+_transformer = None
+
+
+def project(traj):
+    """
+    Project a (lat, lon) trajectory, as recorded in `env.agent_traj` and `env.true_traj`,
+    to planar (x, y) coordinates in meters.
+    """
+    global _transformer
+    if _transformer is None:
+        _transformer = pyproj.Transformer.from_crs("EPSG:4326", PROJECTION, always_xy=True)
+    traj = np.asarray(traj, dtype=np.float64).reshape(-1, 2)
+    x, y = _transformer.transform(traj[:, 1], traj[:, 0])
+    return np.column_stack((x, y))
+
+
+def _wavefront(a, b, frechet, threshold):
+    """
+    Fill the DTW / discrete Fréchet table anti-diagonal by anti-diagonal so that every
+    diagonal is a single vectorized numpy operation and only two diagonals are kept in memory.
+    Every warping path visits diagonal k or k+1, hence the computation is abandoned (inf)
+    as soon as both of them exceed the threshold. A distance above the threshold is always inf.
+    """
+    n, m = len(a), len(b)
+    # index p on a diagonal refers to row i = p - 1; p = 0 is a sentinel for i = -1
+    prev2 = np.full(n + 1, np.inf)
+    prev = np.full(n + 1, np.inf)
+    prev_min = np.inf
+    for k in range(n + m - 1):
+        i = np.arange(max(0, k - m + 1), min(n - 1, k) + 1)
+        cost = np.hypot(*(a[i] - b[k - i]).T)
+        cur = np.full(n + 1, np.inf)
+        if k == 0:
+            cur[1] = cost[0]
+        else:
+            best = np.minimum(np.minimum(prev[i], prev[i + 1]), prev2[i])
+            cur[i + 1] = np.maximum(cost, best) if frechet else cost + best
+        cur_min = cur[i + 1].min()
+        if min(prev_min, cur_min) > threshold:
+            return np.inf
+        prev2, prev, prev_min = prev, cur, cur_min
+    return prev[n] if prev[n] <= threshold else np.inf
+
+
+def dtw(a, b, threshold=np.inf, projected=False):
+    """
+    Dynamic time warping distance (sum of matched point distances in meters) between two
+    (lat, lon) trajectories. Returns inf if the distance exceeds `threshold`.
+    """
+    if not projected:
+        a, b = project(a), project(b)
+    return _wavefront(a, b, False, threshold)
+
+
+def discrete_frechet(a, b, threshold=np.inf, projected=False):
+    """
+    Discrete Fréchet distance (in meters) between two (lat, lon) trajectories.
+    Returns inf if the distance exceeds `threshold`.
+    """
+    if not projected:
+        a, b = project(a), project(b)
+    return _wavefront(a, b, True, threshold)
+
+
+def _distance(metric, a, b, threshold=np.inf):
+    if metric == "dtw":
+        return _wavefront(a, b, False, threshold)
+    if metric == "frechet":
+        return _wavefront(a, b, True, threshold)
+    raise ValueError(f"Unknown trajectory metric '{metric}', expected one of {METRICS}")
+
+
+def _box_distances(points, boxes):
+    """Distances of every point (n, 2) to every bounding box (c, 4) -> (n, c)"""
+    dx = np.maximum(
+        np.maximum(boxes[None, :, 0] - points[:, None, 0], points[:, None, 0] - boxes[None, :, 2]), 0
+    )
+    dy = np.maximum(
+        np.maximum(boxes[None, :, 1] - points[:, None, 1], points[:, None, 1] - boxes[None, :, 3]), 0
+    )
+    return np.hypot(dx, dy)
+
+
+class TrajectoryIndex:
+    """
+    Projected trajectories stored as one contiguous point array so that lower bounds of
+    the query against all of them can be computed in a few vectorized operations.
+    """
+
+    def __init__(self, trajectories, ids=None):
+        projected = [project(t) for t in trajectories]
+        self.ids = list(range(len(projected))) if ids is None else list(ids)
+        self.lengths = np.array([len(p) for p in projected])
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+        if len(projected) == 0:
+            raise ValueError("TrajectoryIndex needs at least one trajectory")
+        self.points = np.concatenate(projected)
+        self.starts = self.points[self.offsets[:-1]]
+        self.ends = self.points[self.offsets[1:] - 1]
+        self.boxes = np.column_stack(
+            (
+                np.minimum.reduceat(self.points[:, 0], self.offsets[:-1]),
+                np.minimum.reduceat(self.points[:, 1], self.offsets[:-1]),
+                np.maximum.reduceat(self.points[:, 0], self.offsets[:-1]),
+                np.maximum.reduceat(self.points[:, 1], self.offsets[:-1]),
+            )
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.points[self.offsets[i] : self.offsets[i + 1]]
+
+    def lower_bounds(self, query, metric="dtw"):
+        """
+        Lower bounds of the distance between the projected query and every indexed trajectory.
+        Uses the matched endpoints and the distance of each point to the other trajectory's
+        bounding box (every point is matched at least once).
+        """
+        d_start = np.hypot(*(self.starts - query[0]).T)
+        d_end = np.hypot(*(self.ends - query[-1]).T)
+        q_to_boxes = _box_distances(query, self.boxes)
+        q_box = np.array([[*query.min(axis=0), *query.max(axis=0)]])
+        points_to_q = _box_distances(self.points, q_box)[:, 0]
+        if metric == "dtw":
+            single = (self.lengths == 1) & (len(query) == 1)
+            endpoints = np.where(single, d_start, d_start + d_end)
+            envelope = np.maximum(
+                q_to_boxes.sum(axis=0), np.add.reduceat(points_to_q, self.offsets[:-1])
+            )
+        elif metric == "frechet":
+            endpoints = np.maximum(d_start, d_end)
+            envelope = np.maximum(
+                q_to_boxes.max(axis=0), np.maximum.reduceat(points_to_q, self.offsets[:-1])
+            )
+        else:
+            raise ValueError(f"Unknown trajectory metric '{metric}', expected one of {METRICS}")
+        return np.maximum(endpoints, envelope)
+
+    def k_nearest(self, query, k=5, metric="dtw", projected=False):
+        """
+        The k nearest indexed trajectories as a list of (id, distance), closest first.
+        Candidates are visited in order of their lower bound; the search stops once the bound
+        exceeds the current k-th best distance, which also serves as early-abandon threshold.
+        """
+        if not projected:
+            query = project(query)
+        bounds = self.lower_bounds(query, metric)
+        best = []
+        for i in np.argsort(bounds, kind="stable"):
+            threshold = best[-1][1] if len(best) == k else np.inf
+            if bounds[i] > threshold:
+                break
+            d = _distance(metric, query, self[i], threshold)
+            if d <= threshold and np.isfinite(d):
+                best.append((self.ids[i], float(d)))
+                best.sort(key=lambda item: item[1])
+                del best[k:]
+        return best
+
+    def k_nearest_many(self, queries, k=5, metric="dtw", n_jobs=None):
+        """k_nearest for a list of (lat, lon) trajectories, spread over a process pool"""
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(self,)) as pool:
+            return list(
+                pool.map(_worker_k_nearest, queries, [k] * len(queries), [metric] * len(queries))
+            )
+
+
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _worker_k_nearest(query, k, metric):
+    return _worker_data.k_nearest(query, k, metric)
+
+
+def _worker_pairwise_row(i, metric):
+    index = _worker_data
+    return [_distance(metric, index[i], index[j]) for j in range(i + 1, len(index))]
+
+
+def pairwise_distances(trajectories, metric="dtw", n_jobs=None):
+    """Symmetric matrix of all pairwise distances between (lat, lon) trajectories"""
+    index = TrajectoryIndex(trajectories)
+    n = len(index)
+    out = np.zeros((n, n))
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(index,)) as pool:
+        # rows are submitted longest first to balance the triangular workload
+        for i, row in zip(range(n), pool.map(_worker_pairwise_row, range(n), [metric] * n)):
+            out[i, i + 1 :] = row
+            out[i + 1 :, i] = row
+    return out
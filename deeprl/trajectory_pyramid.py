@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+from deeprl.ais_dataset import BOUND_COLUMNS, DTYPES, EPISODE_COLUMNS, partition_keys
+
+# angles (degrees) are averaged on the circle, positions are point samples, everything else is averaged
+CIRCULAR_COLUMNS = ["direction", "wind_direction"]
+POSITION_COLUMNS = ["lat", "lon"]
+
+
+def _downsample(values, starts, lengths, stride):
+    """
+    Rows 0, stride, 2 * stride, ... and the last row of every trajectory (the rows the environment
+    visits with `time_multipler = stride`). Positions are taken from these rows, the other columns
+    are aggregated over the rows since the previous sample, i.e. (previous sample, sample].
+    """
+    n_samples = (lengths - 1 + stride - 1) // stride + 1
+    traj = np.repeat(np.arange(len(lengths)), n_samples)
+    sample_offsets = np.concatenate(([0], np.cumsum(n_samples)))
+    k = np.arange(sample_offsets[-1]) - sample_offsets[traj]
+    samples = starts[traj] + np.minimum(k * stride, lengths[traj] - 1)
+    window_starts = np.where(k == 0, samples, np.concatenate(([0], samples[:-1])) + 1)
+    counts = (samples - window_starts + 1)[:, None]
+
+    level = np.add.reduceat(values, window_starts, axis=0) / counts
+    circular = [EPISODE_COLUMNS.index(c) for c in CIRCULAR_COLUMNS]
+    radians = np.deg2rad(values[:, circular])
+    sin = np.add.reduceat(np.sin(radians), window_starts, axis=0)
+    cos = np.add.reduceat(np.cos(radians), window_starts, axis=0)
+    level[:, circular] = np.rad2deg(np.arctan2(sin, cos)) % 360
+    positions = [EPISODE_COLUMNS.index(c) for c in POSITION_COLUMNS]
+    level[:, positions] = values[samples][:, positions]
+    return level.astype(np.float32), sample_offsets
+
+
+def build_pyramid(dataset, directory, strides=(1, 3, 6, 12)):
+    """
+    Precompute downsampled copies of every trajectory of a csv dataset for the given strides
+    (multiples of the 10 second resampling interval) together with the bounds of every level.
+    """
+    os.makedirs(directory, exist_ok=True)
+    df = pd.read_csv(dataset, dtype=DTYPES, usecols=["traj_id"] + BOUND_COLUMNS)
+    # rows of a trajectory are contiguous and keep their (temporal) order
+    df = df.sort_values("traj_id", kind="stable")
+    ids, starts, lengths = np.unique(df["traj_id"].to_numpy(), return_index=True, return_counts=True)
+    values = df[EPISODE_COLUMNS].to_numpy(np.float64)
+    strides = sorted(set(strides) | {1})
+    bounds = {}
+    for stride in strides:
+        level, offsets = _downsample(values, starts, lengths, stride)
+        np.save(os.path.join(directory, f"level_{stride}.npy"), level)
+        np.save(os.path.join(directory, f"offsets_{stride}.npy"), offsets)
+        level_bounds = {c: [float(df[c].min()), float(df[c].max())] for c in BOUND_COLUMNS}
+        for i, c in enumerate(EPISODE_COLUMNS):
+            level_bounds[c] = [float(level[:, i].min()), float(level[:, i].max())]
+        bounds[str(stride)] = level_bounds
+        print(f"stride {stride}: {len(level)} rows")
+    with open(os.path.join(directory, "index.json"), "w") as f:
+        json.dump({"strides": strides, "ids": ids.tolist(), "bounds": bounds}, f)
+
+
+class PyramidTrajectories:
+    """
+    Trajectories of a pyramid written by `build_pyramid`. `select` picks the level for a
+    `time_multipler` (the coarsest level whose stride divides it); levels are memory mapped,
+    so only the rows of the selected level that are actually visited are read.
+    """
+
+    def __init__(self, directory, partition=None):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json"), "r") as f:
+            meta = json.load(f)
+        self.strides = meta["strides"]
+        self.keys = meta["ids"]
+        self.positions = {traj_id: i for i, traj_id in enumerate(self.keys)}
+        if partition is not None:
+            self.restrict(partition_keys(self.keys, *partition))
+        self.level_bounds = {int(s): {c: tuple(b) for c, b in level.items()} for s, level in meta["bounds"].items()}
+        self.levels = {}
+        # stride of the level to use for every time_multipler up to the coarsest level
+        self.level_for = {
+            multipler: max(s for s in self.strides if multipler % s == 0) for multipler in range(1, max(self.strides) + 1)
+        }
+        self.select(1)
+
+    def select(self, time_multipler):
+        """Switch to the level for `time_multipler` and return the number of its rows per step"""
+        stride = self.level_for.get(time_multipler)
+        if stride is None:
+            stride = max(s for s in self.strides if time_multipler % s == 0)
+        if stride not in self.levels:
+            self.levels[stride] = (
+                np.load(os.path.join(self.directory, f"level_{stride}.npy"), mmap_mode="r"),
+                np.load(os.path.join(self.directory, f"offsets_{stride}.npy")),
+            )
+        self.stride = stride
+        self.bounds = self.level_bounds[stride]
+        return time_multipler // stride
+
+    def episode_order(self):
+        order = list(self.keys)
+        random.shuffle(order)
+        return order
+
+    def restrict(self, keys):
+        self.keys = list(keys)
+
+    def get(self, key):
+        data, offsets = self.levels[self.stride]
+        i = self.positions[key]
+        return pd.DataFrame(np.asarray(data[offsets[i] : offsets[i + 1]]), columns=EPISODE_COLUMNS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute multi-resolution trajectory pyramids for the ais environment")
+    parser.add_argument("dataset", type=str, help="csv dataset, e.g. data/usable/aishub_linear_big_ships_2020_wind_tides_lengths.csv")
+    parser.add_argument("directory", type=str, help="output directory, e.g. data/usable/big_ships_2020_pyramid")
+    parser.add_argument("--strides", nargs="+", default=[1, 3, 6, 12], type=int, help="level strides (multiples of 10 seconds)")
+    args = parser.parse_args()
+    build_pyramid(args.dataset, args.directory, args.strides)